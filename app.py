@@ -1,11 +1,19 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import bcrypt
 from supabase import create_client, Client
 from cryptography.fernet import Fernet
-from datetime import datetime, timedelta
-import urllib.parse
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESSIV
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import base64
+from urllib.parse import quote_plus
+import functools
 import time
+import hashlib
+import hmac
+import re
 
 # --- 1. 初始化與 UI 設定 (Apple-Style Clean UI) ---
 st.set_page_config(
@@ -16,7 +24,7 @@ st.set_page_config(
 )
 
 # 自定義 CSS：隱藏 Streamlit 原生選單與 Footer，讓它更像一個獨立 App
-st.markdown("""
+APP_CSS = """
     <style>
         #MainMenu {visibility: hidden;}
         footer {visibility: hidden;}
@@ -37,7 +45,15 @@ st.markdown("""
             color: #333;
         }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def load_css() -> str:
+    # 壓縮空白後快取於 process 層級，每次 rerun 只送出精簡後的 <style>
+    # (Streamlit 會移除 rerun 時未重新輸出的元素，因此仍需每次輸出；fragment 內的互動則不會重送)
+    return re.sub(r"\s+", " ", re.sub(r"/\*.*?\*/", "", APP_CSS)).strip()
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # --- 2. 安全性與連線 (保持不變的核心邏輯) ---
 try:
@@ -52,108 +68,556 @@ except Exception as e:
 def init_supabase():
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
+@st.cache_resource
+def init_ciphers():
+    # 金鑰只在 process 啟動時衍生一次，之後每次 rerun 直接重用
+    # AES-SIV：確定性認證加密，金鑰由主金鑰以 HKDF 衍生
+    siv = AESSIV(HKDF(algorithm=hashes.SHA256(), length=64, salt=None, info=b"insurance-crm aes-siv").derive(ENCRYPTION_KEY.encode()))
+    # 搜尋雜湊用的 HMAC 金鑰，以不同 info 衍生，與加密金鑰分開
+    hash_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"insurance-crm search-hash").derive(ENCRYPTION_KEY.encode())
+    # Fernet：舊資料 (Fernet token) 解密用
+    return siv, Fernet(ENCRYPTION_KEY), hash_key
+
+SIV_PREFIX = "siv:"
+
+@st.cache_resource
+def init_decrypt():
+    # Streamlit 每次 rerun 都以新的 __main__ 執行 app.py，模組層級的 lru_cache 會跟著重建；
+    # 在 cache_resource 內建立，快取才會跨 rerun / session 共用
+    siv, fernet, _ = init_ciphers()
+    prefix = SIV_PREFIX
+
+    @functools.lru_cache(maxsize=8192)
+    def decrypt(text: str) -> str:
+        """同一密文解密結果固定，快取後跳過重複運算；同時支援 AES-SIV 與舊的 Fernet 密文"""
+        try:
+            if text.startswith(prefix):
+                return siv.decrypt(base64.urlsafe_b64decode(text[len(prefix):]), None).decode()
+            return fernet.decrypt(text.encode()).decode()
+        except:
+            return "[解密失敗]"
+    return decrypt
+
 supabase: Client = init_supabase()
-cipher_suite = Fernet(ENCRYPTION_KEY)
+siv_cipher, _, SEARCH_HASH_KEY = init_ciphers()
+decrypt_text = init_decrypt()
+
+# bcrypt 工作係數：每 +1 運算時間加倍。調低可加快登入，但也讓離線暴力破解同樣變快，建議不低於 10
+try:
+    BCRYPT_ROUNDS = int(st.secrets.get("security", {}).get("bcrypt_rounds", 12))
+    if not 4 <= BCRYPT_ROUNDS <= 31: raise ValueError
+except (TypeError, ValueError):
+    st.error("❌ security.bcrypt_rounds 必須是 4 到 31 之間的整數。")
+    st.stop()
+
+PAGE_SIZE = 50 # 客戶名單每頁筆數
+CLIENTS_REFRESH_SECONDS = 60 # session 內的客戶資料超過此秒數即與伺服器重新同步 (同快取 TTL)
+DATE_FORMAT = "%Y-%m-%d" # 資料庫 expiry_date 格式；指定格式讓 pandas 走快速解析並快取重複日期
+CLIENT_FIELDS = "id,encrypted_name,encrypted_plate,phone_number,expiry_date,insurance_type,notes" # 只取畫面需要的欄位
+CLIENT_COLUMNS = ["ID", "狀態", "姓名", "保險種類", "車牌", "到期日", "剩餘天數", "電話", "備註", "日曆連結"]
 
 # --- 3. 核心功能函數 ---
 
 def encrypt_text(text: str) -> str:
+    """以 AES-SIV 加密 (加上前綴以區分舊的 Fernet 密文)"""
     if not text: return ""
-    return cipher_suite.encrypt(text.encode()).decode()
+    return SIV_PREFIX + base64.urlsafe_b64encode(siv_cipher.encrypt(text.encode(), None)).decode()
 
-def decrypt_text(text: str) -> str:
-    try:
-        return cipher_suite.decrypt(text.encode()).decode()
-    except:
-        return "[解密失敗]"
+def decrypt_many(texts) -> list:
+    """批次解密：預先綁定 decrypt，省去每筆的屬性查找 (命中 decrypt_text 快取)"""
+    decrypt = decrypt_text
+    return [decrypt(text) for text in texts]
+
+def search_hash(text: str) -> str:
+    """可搜尋的雜湊值 (HMAC-SHA256，金鑰由主金鑰衍生)，供伺服器端以索引做等值比對"""
+    if not text: return ""
+    return hmac.new(SEARCH_HASH_KEY, text.strip().encode(), hashlib.sha256).hexdigest()
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 def check_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
-def generate_calendar_link(client_name, expiry_date_str, insurance_type):
-    try:
-        exp_date = datetime.strptime(expiry_date_str, "%Y-%m-%d")
-        rem_date = exp_date - timedelta(days=30)
-        start = rem_date.strftime("%Y%m%d")
-        end = (rem_date + timedelta(days=1)).strftime("%Y%m%d")
-        title = f"續保提醒：{client_name} ({insurance_type})"
-        details = f"客戶 {client_name} 的 {insurance_type} 即將於 {expiry_date_str} 到期。"
-        base_url = "https://calendar.google.com/calendar/render"
-        params = {"action": "TEMPLATE", "text": title, "dates": f"{start}/{end}", "details": details}
-        return f"{base_url}?{urllib.parse.urlencode(params)}"
-    except:
-        return "#"
+CALENDAR_URL = "https://calendar.google.com/calendar/render?action=TEMPLATE&text="
+
+def calendar_links(names, expiry_dates, insurance_types):
+    """批次產生 Google 日曆提醒連結 (到期前 30 天)，以 pandas 欄位運算一次完成"""
+    names, expiry_dates, insurance_types = names.astype(str), expiry_dates.astype(str), insurance_types.astype(str)
+    rem_date = pd.to_datetime(expiry_dates, format=DATE_FORMAT, cache=True) - pd.Timedelta(days=30)
+    start = rem_date.dt.strftime("%Y%m%d")
+    end = (rem_date + pd.Timedelta(days=1)).dt.strftime("%Y%m%d")
+    title = "續保提醒：" + names + " (" + insurance_types + ")"
+    details = "客戶 " + names + " 的 " + insurance_types + " 即將於 " + expiry_dates + " 到期。"
+    return (CALENDAR_URL + title.map(quote_plus)
+            + "&dates=" + start + "%2F" + end + "&details=" + details.map(quote_plus))
 
 # --- 4. 資料庫操作 (CRUD) - 更新版 ---
 
 def login_user(username, password):
-    response = supabase.table("users").select("*").eq("username", username).execute()
+    # 只取登入需要的欄位，減少傳輸量
+    response = supabase.table("users").select("id,username,full_name,password_hash").eq("username", username).limit(1).execute()
     if not response.data: return False, None
     user_data = response.data[0]
     if check_password(password, user_data["password_hash"]):
         return True, user_data
     return False, None
 
-def add_client(agent_user, name, plate, phone, expiry, insurance_type, notes):
-    """新增資料：包含保險種類"""
-    payload = {
+def client_payload(agent_user, name, plate, phone, expiry, insurance_type, notes) -> dict:
+    """組出寫入 clients 資料表的一筆資料 (姓名、車牌加密)"""
+    return {
         "agent_username": agent_user,
         "encrypted_name": encrypt_text(name),
         "encrypted_plate": encrypt_text(plate),
+        "name_hash": search_hash(name), # 供伺服器端搜尋
+        "plate_hash": search_hash(plate),
         "phone_number": phone,
         "expiry_date": str(expiry),
         "insurance_type": insurance_type, # 新增欄位
         "notes": notes
     }
+
+def insert_clients(payload: list):
+    """寫入 clients；尚未套用 migrations.sql (沒有雜湊欄位) 時改為不含雜湊欄位寫入"""
+    try:
+        return supabase.table("clients").insert(payload).execute()
+    except Exception as e:
+        if "name_hash" not in str(e): raise
+        stripped = [{k: v for k, v in row.items() if k not in ("name_hash", "plate_hash")} for row in payload]
+        return supabase.table("clients").insert(stripped).execute()
+
+def backfill_search_hashes(agent_user):
+    """為尚無搜尋雜湊的舊資料補上 name_hash / plate_hash，每 500 筆以一次 upsert 寫回 (帶上原有欄位)；
+    回傳更新筆數，雜湊欄位不存在 (尚未套用 migrations.sql) 時回傳 None，其他錯誤直接拋出"""
+    updated, seen = 0, set()
+    try:
+        while True:
+            rows = supabase.table("clients").select("*").eq("agent_username", agent_user).is_("name_hash", "null").limit(500).execute().data or []
+            batch = []
+            for row in rows:
+                if row["id"] in seen: continue # 已處理過卻仍未更新 (例如無法解密或權限不足)，避免無限重試
+                seen.add(row["id"])
+                name, plate = decrypt_text(row["encrypted_name"]), decrypt_text(row["encrypted_plate"])
+                if "[解密失敗]" in (name, plate): continue
+                batch.append({**row, "name_hash": search_hash(name), "plate_hash": search_hash(plate)})
+            if not batch: break
+            supabase.table("clients").upsert(batch, on_conflict="id").execute()
+            updated += len(batch)
+    except Exception as e:
+        if "name_hash" in str(e): return None
+        raise
+    return updated
+
+@st.cache_resource
+def init_backfilled_agents() -> set:
+    # 已完成補雜湊的業務帳號 (process 層級)；失敗時不記錄，下次登入再試
+    return set()
+
+def ensure_search_hashes(agent_user):
+    """登入後為該業務的舊資料補搜尋雜湊，每個 process 成功一次即不再執行"""
+    done = init_backfilled_agents()
+    if agent_user in done: return
+    with st.spinner("正在為舊資料建立搜尋索引..."):
+        try:
+            updated = backfill_search_hashes(agent_user)
+        except Exception as e:
+            st.warning(f"舊資料搜尋索引建立失敗，下次登入將重試：{e}")
+            return
+    # 欄位尚未建立 (updated 為 None) 也記錄，避免每次 rerun 都多一次查詢；套用 migrations.sql 後重新啟動 app 即會補上
+    done.add(agent_user)
+    if updated: clear_client_cache()
+
+def add_client(agent_user, name, plate, phone, expiry, insurance_type, notes):
+    """新增資料：包含保險種類；成功時回傳寫入後的資料列 (含 id)，失敗回傳 None"""
+    payload = client_payload(agent_user, name, plate, phone, expiry, insurance_type, notes)
     try:
-        supabase.table("clients").insert(payload).execute()
-        return True
+        response = insert_clients([payload])
+        clear_client_cache() # 清除快取，下次 rerun 重新讀取
+        return response.data[0] if response.data else payload
     except Exception as e:
         st.error(f"寫入失敗: {e}")
-        return False
+        return None
+
+def add_clients_bulk(agent_user, df_in: pd.DataFrame) -> int:
+    """批次匯入：一次 insert 寫入所有資料 (單一請求、單一交易，全部成功或全部失敗)，回傳筆數"""
+    payload = [
+        client_payload(agent_user, r.姓名, r.車牌, r.電話, r.到期日, r.保險種類, r.備註)
+        for r in df_in.itertuples(index=False)
+    ]
+    if not payload: return 0
+    try:
+        insert_clients(payload)
+        clear_client_cache()
+        return len(payload)
+    except Exception as e:
+        st.error(f"匯入失敗: {e}")
+        return 0
+
+STATUS_LABELS = np.array(["❌ 已過期", "⚠️ 即將到期", "✅ 正常"], dtype=object)
+
+def compute_status(expiry_dates, today: pd.Timestamp):
+    """一次計算剩餘天數與狀態代碼 (0=已過期、1=即將到期、2=正常)，全程在 NumPy 陣列上運算"""
+    exp_days = pd.to_datetime(expiry_dates, format=DATE_FORMAT, cache=True).to_numpy().astype("datetime64[D]")
+    days = (exp_days - today.to_datetime64().astype("datetime64[D]")).astype(np.int64)
+    codes = (days >= 0).astype(np.int8) + (days > 30)
+    return days, codes
+
+def build_client_df(data, today: pd.Timestamp) -> pd.DataFrame:
+    """將資料庫原始資料轉為畫面用 DataFrame (解密 + 狀態計算)"""
+    raw = pd.DataFrame(data)
+
+    # 狀態判斷 (向量化：一次解析所有日期，代碼再對應到顯示文字)
+    days, codes = compute_status(raw["expiry_date"], today)
+    status = STATUS_LABELS[codes]
+
+    # 以欄位一次組出 DataFrame，避免每筆資料建立 dict
+    df = pd.DataFrame({
+        "ID": raw["id"],
+        "狀態": status,
+        "姓名": decrypt_many(raw["encrypted_name"]),
+        "保險種類": raw["insurance_type"] if "insurance_type" in raw else "未分類", # 讀取新欄位
+        "車牌": decrypt_many(raw["encrypted_plate"]),
+        "到期日": raw["expiry_date"],
+        "剩餘天數": days,
+        "電話": raw["phone_number"],
+        "備註": raw["notes"]
+    })
+    df["日曆連結"] = calendar_links(df["姓名"], df["到期日"], df["保險種類"])
+    return df
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_client_stats(agent_user: str, today: pd.Timestamp) -> dict:
+    """儀表板指標：三個只回傳筆數 (head) 的查詢，不傳輸資料列、不需解密"""
+    def count(query):
+        return query.execute().count or 0
+    def clients():
+        return supabase.table("clients").select("id", count="exact", head=True).eq("agent_username", agent_user)
+    try:
+        today_str = today.strftime(DATE_FORMAT)
+        soon_str = (today + pd.Timedelta(days=30)).strftime(DATE_FORMAT)
+        return {
+            "total": count(clients()),
+            "urgent": count(clients().gte("expiry_date", today_str).lte("expiry_date", soon_str)),
+            "expired": count(clients().lt("expiry_date", today_str)),
+        }
+    except Exception as e:
+        st.error(f"讀取失敗: {e}")
+        return {"total": 0, "urgent": 0, "expired": 0}
 
-def get_clients(agent_user):
-    """讀取資料：包含保險種類與狀態計算"""
+@st.cache_data(ttl=60, show_spinner=False)
+def get_clients(agent_user: str, today: pd.Timestamp, page: int = 0) -> pd.DataFrame:
+    """讀取資料 (單頁)：包含保險種類與狀態計算 (快取 60 秒，避免每次 rerun 重新連線與解密)"""
     try:
-        response = supabase.table("clients").select("*").eq("agent_username", agent_user).order("expiry_date").execute()
+        start = page * PAGE_SIZE
+        response = supabase.table("clients").select(CLIENT_FIELDS).eq("agent_username", agent_user).order("expiry_date").order("id").range(start, start + PAGE_SIZE - 1).execute()
         data = response.data
-        if not data: return pd.DataFrame()
-
-        processed_data = []
-        today = datetime.now().date()
+        if not data: return pd.DataFrame(columns=CLIENT_COLUMNS) # 保留欄位，空頁面也能正常顯示
+        return build_client_df(data, today)
+    except Exception as e:
+        st.error(f"讀取失敗: {e}")
+        return pd.DataFrame(columns=CLIENT_COLUMNS)
 
-        for row in data:
-            expiry_date = datetime.strptime(row["expiry_date"], "%Y-%m-%d").date()
-            days_left = (expiry_date - today).days
-            
-            # 狀態判斷
-            if days_left < 0: status = "❌ 已過期"
-            elif days_left <= 30: status = "⚠️ 即將到期"
-            else: status = "✅ 正常"
-
-            processed_data.append({
-                "ID": row["id"],
-                "狀態": status,
-                "姓名": decrypt_text(row["encrypted_name"]),
-                "保險種類": row.get("insurance_type", "未分類"), # 讀取新欄位
-                "車牌": decrypt_text(row["encrypted_plate"]),
-                "到期日": row["expiry_date"],
-                "剩餘天數": days_left,
-                "電話": row["phone_number"],
-                "備註": row["notes"]
-            })
-        return pd.DataFrame(processed_data)
+@st.cache_data(ttl=60, show_spinner=False)
+def get_all_clients(agent_user: str, today: pd.Timestamp) -> pd.DataFrame:
+    """讀取全部資料 (僅供本地模糊搜尋)：每次 1000 筆分批讀取，避開單次回傳筆數上限"""
+    data, start, batch = [], 0, 1000
+    try:
+        while True:
+            rows = supabase.table("clients").select(CLIENT_FIELDS).eq("agent_username", agent_user).order("expiry_date").order("id").range(start, start + batch - 1).execute().data or []
+            data.extend(rows)
+            if len(rows) < batch: break
+            start += batch
+        if not data: return pd.DataFrame(columns=CLIENT_COLUMNS)
+        return build_client_df(data, today)
     except Exception as e:
         st.error(f"讀取失敗: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(columns=CLIENT_COLUMNS)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def search_clients(agent_user: str, query: str, today: pd.Timestamp, skip: int = 0, take: int = 50):
+    """伺服器端搜尋：以姓名/車牌雜湊做等值比對，一次 RPC 取回該頁資料與總筆數
+    (需先套用 migrations.sql 中的 search_clients 函數)；RPC 不可用時回傳 (None, 0)"""
+    try:
+        response = supabase.rpc("search_clients", {
+            "agent": agent_user, "q": search_hash(query), "skip": skip, "take": take
+        }).execute()
+        result = response.data or {}
+        rows, total = result.get("rows") or [], result.get("total", 0)
+        if not rows: return pd.DataFrame(columns=CLIENT_COLUMNS), total
+        return build_client_df(rows, today), total
+    except Exception:
+        return None, 0
 
 def delete_client(client_id):
     supabase.table("clients").delete().eq("id", client_id).execute()
+    clear_client_cache()
+
+def clear_client_cache():
+    get_client_stats.clear()
+    get_clients.clear()
+    get_all_clients.clear()
+    search_clients.clear()
+
+# --- 5. Session 資料 (樂觀更新) ---
+
+def session_clients(agent_user, today):
+    """本 session 的客戶指標與已載入頁面；只在版本號變更或資料超過 CLIENTS_REFRESH_SECONDS 時重新讀取"""
+    state = st.session_state
+    state.setdefault("clients_version", 0)
+    key = (agent_user, today, state["clients_version"])
+    if state.get("clients_key") != key or time.monotonic() - state["clients_fetched_at"] > CLIENTS_REFRESH_SECONDS:
+        state["clients_key"] = key
+        state["clients_fetched_at"] = time.monotonic()
+        state["client_stats"] = dict(get_client_stats(agent_user, today))
+        state["client_pages"] = {}
+    return state["client_stats"], state["client_pages"]
+
+def refresh_clients():
+    """放棄本地資料，下次 rerun 重新向伺服器讀取"""
+    clear_client_cache()
+    st.session_state["clients_version"] = st.session_state.get("clients_version", 0) + 1
+
+def count_status(stats, days_left, step):
+    stats["total"] += step
+    if days_left < 0: stats["expired"] += step
+    elif days_left <= 30: stats["urgent"] += step
+
+def apply_added_client(row, today):
+    """新增成功後直接更新本地資料，不必重新讀取"""
+    state = st.session_state
+    if "client_pages" not in state: return
+    if "id" not in row: # 伺服器未回傳新資料列，改為重新讀取
+        refresh_clients()
+        return
+    new_df = build_client_df([row], today)
+    total = state["client_stats"]["total"] # 新增前的總筆數
+    count_status(state["client_stats"], int(new_df["剩餘天數"].iloc[0]), 1)
+    # 依 (到期日, ID) 放入對應的已載入頁面並維持每頁 PAGE_SIZE 筆 (新 ID 最大，同日期排最後)
+    pages = state["client_pages"]
+    p = 0
+    while p in pages:
+        df = pages[p]
+        if is_last_page(p, df, total) or row["expiry_date"] < df["到期日"].max():
+            merged = pd.concat([df, new_df], ignore_index=True).sort_values(["到期日", "ID"], ignore_index=True)
+            pages[p] = merged.head(PAGE_SIZE)
+            break
+        p += 1
+    drop_pages_after(pages, p)
+
+def apply_deleted_client(row):
+    """刪除成功後直接從本地資料移除該筆"""
+    state = st.session_state
+    if "client_pages" not in state: return
+    total = state["client_stats"]["total"] # 刪除前的總筆數
+    count_status(state["client_stats"], row["剩餘天數"], -1)
+    pages = state["client_pages"]
+    p = 0
+    while p in pages and row["ID"] not in set(pages[p]["ID"]):
+        p += 1
+    if p in pages and is_last_page(p, pages[p], total):
+        # 最後一頁：直接移除該筆即與伺服器一致
+        pages[p] = pages[p][pages[p]["ID"] != row["ID"]].reset_index(drop=True)
+        drop_pages_after(pages, p)
+    else:
+        # 其他頁面：下一頁的第一筆會往前補進此頁，連同之後的頁面一起重新讀取
+        drop_pages_after(pages, p - 1)
+
+def is_last_page(page, df, total) -> bool:
+    """此頁是否為伺服器上的最後一頁 (依總筆數判斷，不以頁面筆數推測)"""
+    return page * PAGE_SIZE + len(df) >= total
+
+def drop_pages_after(pages, page):
+    """新增/刪除後，之後的頁面在伺服器上的位移已改變，移除讓它們重新讀取"""
+    for p in [p for p in pages if p > page]:
+        del pages[p]
+
+# --- 6. 畫面元件 (Fragments) ---
+
+@st.fragment
+def render_dashboard(agent_user, today):
+    """儀表板分頁：搜尋、翻頁與選取只重跑此 fragment (資料保存在 session，新增/刪除時直接更新)"""
+    stats, pages = session_clients(agent_user, today)
+    if stats["total"]:
+        # 1. 關鍵指標 (Key Metrics)
+        total_clients = stats["total"]
+        # 30 天內到期 (且未過期)
+        urgent_count = stats["urgent"]
+        expired_count = stats["expired"]
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("總客戶數", f"{total_clients} 位", delta="累積名單")
+        m2.metric("30天內到期", f"{urgent_count} 位", delta="需立即聯繫", delta_color="inverse")
+        m3.metric("已過期", f"{expired_count} 位", delta="失效名單", delta_color="off")
+
+        st.divider()
+
+        # 2. 搜尋列
+        s1, s2 = st.columns([4, 1])
+        search_term = s1.text_input("🔍 搜尋客戶 (輸入完整姓名或車牌)", placeholder="Ex: 王小明 or ABC-1234")
+        fuzzy = s2.toggle("模糊搜尋", help="以部分姓名或車牌比對；需下載並解密全部客戶資料，客戶多時較慢")
+
+        # 3. 資料展示 (Data Display)
+        if search_term and fuzzy:
+            # 模糊搜尋 (使用者自行開啟)：需涵蓋全部客戶，因此下載並解密全部資料後於本地比對
+            all_df = get_all_clients(agent_user, today)
+            display_df = all_df[
+                all_df["姓名"].str.contains(search_term, regex=False, na=False) | 
+                all_df["車牌"].str.contains(search_term, regex=False, na=False)
+            ].reset_index(drop=True)
+            st.caption(f"共 {len(display_df)} 筆符合 (模糊搜尋：已比對全部 {len(all_df)} 位客戶)")
+        elif search_term:
+            # 伺服器端索引搜尋：只比對完整姓名或車牌，不需下載全部資料
+            matched_df, match_total = search_clients(agent_user, search_term, today, 0, PAGE_SIZE)
+            if matched_df is None:
+                display_df = pd.DataFrame(columns=CLIENT_COLUMNS)
+                st.caption("伺服器端搜尋尚未啟用，請開啟「模糊搜尋」")
+            else:
+                if match_total > PAGE_SIZE:
+                    result_pages = (match_total - 1) // PAGE_SIZE + 1
+                    result_page = st.number_input(f"搜尋結果頁數 (共 {result_pages} 頁)", min_value=1, max_value=result_pages, value=1, step=1)
+                    matched_df, _ = search_clients(agent_user, search_term, today, (result_page - 1) * PAGE_SIZE, PAGE_SIZE)
+                display_df = matched_df
+                if match_total:
+                    st.caption(f"共 {match_total} 筆符合")
+                else:
+                    st.caption("沒有完全相符的客戶；要以部分姓名或車牌比對，請開啟「模糊搜尋」")
+        else:
+            page_count = (total_clients - 1) // PAGE_SIZE + 1
+            page = st.number_input(f"頁數 (共 {page_count} 頁)", min_value=1, max_value=page_count, value=1, step=1)
+            if page - 1 not in pages:
+                pages[page - 1] = get_clients(agent_user, today, page - 1)
+            display_df = pages[page - 1]
+
+        st.markdown("##### 📋 客戶詳細名單")
+
+        # 使用 Pandas Style 進行高亮顯示 (紅色背景標示緊急)
+        def highlight_urgent(frame):
+            # 一次產生整張表的樣式 (向量化)，取代逐列呼叫
+            styles = pd.DataFrame("", index=frame.index, columns=frame.columns)
+            styles.loc[frame["剩餘天數"].between(0, 30), :] = "background-color: #ffe6e6" # 淺紅色
+            styles.loc[frame["剩餘天數"] < 0, :] = "color: #999999" # 灰色字體
+            return styles
+
+        styled_df = display_df[["狀態", "姓名", "保險種類", "車牌", "到期日", "剩餘天數", "備註"]].style.apply(highlight_urgent, axis=None)
+
+        # 互動式表格 (點選列即可選取客戶，只重跑此 fragment)
+        event = st.dataframe(
+            styled_df,
+            column_config={
+                "狀態": st.column_config.TextColumn("狀態", width="small"),
+                "剩餘天數": st.column_config.NumberColumn("剩餘天數 (天)", format="%d"),
+                "到期日": st.column_config.DateColumn("到期日", format="YYYY-MM-DD"),
+            },
+            use_container_width=True,
+            height=400,
+            on_select="rerun",
+            selection_mode="single-row"
+        )
+
+        # 4. 快速操作區 (針對表格中選取的客戶)
+        if not display_df.empty:
+            st.markdown("###### ⚡ 快速操作")
+            selected_rows = [i for i in event.selection.rows if i < len(display_df)]
+
+            if not selected_rows:
+                st.caption("請在上方表格點選一位客戶")
+            else:
+                sel_row = display_df.iloc[selected_rows[0]]
+                st.write(f"**{sel_row['姓名']}** ({sel_row['車牌']})")
+                col_a, col_b, col_c = st.columns([1, 1, 1])
+
+                with col_a:
+                    st.link_button("📅 加入 Google 日曆", sel_row['日曆連結'], use_container_width=True)
+
+                with col_b:
+                    if sel_row['電話']:
+                        st.markdown(f'<a href="tel:{sel_row["電話"]}" target="_self"><button style="width:100%; border:1px solid #ddd; background:white; padding:10px; border-radius:5px;">📞 撥打電話</button></a>', unsafe_allow_html=True)
+                    else:
+                        st.button("無電話", disabled=True, use_container_width=True)
+
+                with col_c:
+                    if st.button("🗑️ 刪除此資料", key=f"del_btn_{sel_row['ID']}", use_container_width=True, type="primary"):
+                        delete_client(sel_row['ID'])
+                        apply_deleted_client(sel_row)
+                        st.toast(f"已刪除 {sel_row['姓名']} 的資料", icon="🗑️")
+                        st.rerun()
 
-# --- 5. 主程式 (UI/UX) ---
+    else:
+        st.info("目前尚無資料，請至「新增客戶」分頁建立第一筆資料。")
+
+@st.fragment
+def render_add(user, today):
+    """新增客戶分頁"""
+    st.markdown("#### 📝 建立新保單")
+    with st.container(border=True):
+        with st.form("add_client_form", clear_on_submit=True):
+            c1, c2 = st.columns(2)
+            with c1:
+                c_name = st.text_input("客戶姓名", placeholder="真實姓名")
+                c_phone = st.text_input("電話號碼", placeholder="09xx-xxx-xxx")
+                # [NEW] 保險種類選單
+                c_type = st.selectbox("保險種類", ["強制險", "任意險", "兩者皆是(日期相同)"])
+
+            with c2:
+                c_plate = st.text_input("車牌號碼", placeholder="ABC-1234")
+                c_expiry = st.date_input("保險到期日")
+                c_notes = st.text_area("備註事項", placeholder="例如：客戶偏好富邦產險...")
+
+            st.caption("🔒 個資保護中：姓名與車牌將加密儲存")
+            submitted = st.form_submit_button("確認新增", use_container_width=True, type="primary")
+
+            if submitted:
+                if c_name and c_plate:
+                    new_row = add_client(user["username"], c_name, c_plate, c_phone, c_expiry, c_type, c_notes)
+                    if new_row:
+                        apply_added_client(new_row, today)
+                        st.toast("✅ 資料新增成功！", icon="🎉")
+                        st.rerun() # 重新整理以更新 dashboard 數據
+                else:
+                    st.toast("❌ 姓名與車牌為必填欄位", icon="⚠️")
+
+    # 批次匯入 (CSV)
+    with st.expander("📤 從 CSV 批次匯入"):
+        st.caption("欄位：姓名、車牌、電話、到期日 (YYYY-MM-DD)、保險種類、備註；姓名與車牌為必填")
+        # 匯入成功後更換 key 以清空上傳的檔案，避免重複匯入
+        uploader_key = f"csv_upload_{st.session_state.get('csv_upload_version', 0)}"
+        uploaded = st.file_uploader("選擇 CSV 檔案", type="csv", key=uploader_key)
+        if uploaded is not None:
+            import_df, read_error = None, None
+            # Excel 匯出的「CSV UTF-8」帶有 BOM，一般「CSV」則多為 Big5 (cp950)
+            for encoding in ("utf-8-sig", "cp950"):
+                try:
+                    uploaded.seek(0)
+                    import_df = pd.read_csv(uploaded, dtype=str, encoding=encoding).fillna("")
+                    break
+                except UnicodeDecodeError as e:
+                    read_error = e
+                except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+                    read_error = e
+                    break
+            if import_df is None:
+                st.error(f"CSV 讀取失敗：{read_error}")
+                return
+            import_df.columns = import_df.columns.str.strip()
+            missing = {"姓名", "車牌", "到期日"} - set(import_df.columns)
+            if missing:
+                st.error(f"CSV 缺少欄位：{'、'.join(sorted(missing))}")
+            else:
+                for col, default in (("電話", ""), ("保險種類", "強制險"), ("備註", "")):
+                    if col not in import_df: import_df[col] = default
+                expiry = pd.to_datetime(import_df["到期日"].str.strip(), format=DATE_FORMAT, errors="coerce")
+                import_df["到期日"] = expiry.dt.strftime(DATE_FORMAT)
+                valid = (import_df["姓名"] != "") & (import_df["車牌"] != "") & expiry.notna()
+                st.write(f"可匯入 {int(valid.sum())} 筆，略過 {int((~valid).sum())} 筆 (缺少必填欄位或日期格式錯誤)")
+                if st.button("確認匯入", type="primary", disabled=not valid.any()):
+                    count = add_clients_bulk(user["username"], import_df[valid])
+                    if count:
+                        refresh_clients() # 大量資料直接重新讀取
+                        st.session_state["csv_upload_version"] = st.session_state.get("csv_upload_version", 0) + 1
+                        st.toast(f"✅ 已匯入 {count} 筆資料", icon="🎉")
+                        st.rerun()
+
+# --- 7. 主程式 (UI/UX) ---
 
 def main():
     if "logged_in" not in st.session_state:
@@ -184,126 +648,27 @@ def main():
     # --- 登入後主畫面 (Dashboard Style) ---
     else:
         user = st.session_state["user_info"]
+        ensure_search_hashes(user["username"])
+        # 今天日期每次 rerun 只計算一次；同時作為快取鍵，跨日後自動重新計算剩餘天數
+        today = pd.Timestamp.today().normalize()
         
         # Header 區域
-        st.markdown(f"### 👋 早安，{user['full_name']}")
-        
-        # 準備資料
-        df = get_clients(user["username"])
+        h1, h2 = st.columns([5, 1])
+        h1.markdown(f"### 👋 早安，{user['full_name']}")
+        if h2.button("🔄 重新整理", use_container_width=True):
+            refresh_clients()
+            st.rerun()
         
         # 分頁設計
         tab_dashboard, tab_add, tab_settings = st.tabs(["📊 總覽與查詢", "➕ 新增客戶", "⚙️ 設定"])
 
         # === Tab 1: 儀表板 (Dashboard) ===
         with tab_dashboard:
-            if not df.empty:
-                # 1. 關鍵指標 (Key Metrics)
-                total_clients = len(df)
-                # 篩選 30 天內到期 (且未過期)
-                urgent_clients = df[(df["剩餘天數"] <= 30) & (df["剩餘天數"] >= 0)]
-                urgent_count = len(urgent_clients)
-                expired_count = len(df[df["剩餘天數"] < 0])
-
-                m1, m2, m3 = st.columns(3)
-                m1.metric("總客戶數", f"{total_clients} 位", delta="累積名單")
-                m2.metric("30天內到期", f"{urgent_count} 位", delta="需立即聯繫", delta_color="inverse")
-                m3.metric("已過期", f"{expired_count} 位", delta="失效名單", delta_color="off")
-                
-                st.divider()
-
-                # 2. 搜尋列
-                search_term = st.text_input("🔍 搜尋客戶 (輸入姓名或車牌)", placeholder="Ex: 王小明 or ABC-1234")
-                
-                # 3. 資料展示 (Data Display)
-                display_df = df.copy()
-                if search_term:
-                    display_df = display_df[
-                        display_df["姓名"].str.contains(search_term) | 
-                        display_df["車牌"].str.contains(search_term)
-                    ]
-
-                st.markdown("##### 📋 客戶詳細名單")
-                
-                # 使用 Pandas Style 進行高亮顯示 (紅色背景標示緊急)
-                def highlight_urgent(row):
-                    if 0 <= row["剩餘天數"] <= 30:
-                        return ['background-color: #ffe6e6'] * len(row) # 淺紅色
-                    elif row["剩餘天數"] < 0:
-                        return ['color: #999999'] * len(row) # 灰色字體
-                    return [''] * len(row)
-
-                styled_df = display_df[["狀態", "姓名", "保險種類", "車牌", "到期日", "剩餘天數", "備註"]].style.apply(highlight_urgent, axis=1)
-
-                # 互動式表格
-                st.dataframe(
-                    styled_df,
-                    column_config={
-                        "狀態": st.column_config.TextColumn("狀態", width="small"),
-                        "剩餘天數": st.column_config.NumberColumn("剩餘天數 (天)", format="%d"),
-                        "到期日": st.column_config.DateColumn("到期日", format="YYYY-MM-DD"),
-                    },
-                    use_container_width=True,
-                    height=400
-                )
-                
-                # 4. 快速操作區 (針對搜尋結果)
-                if not display_df.empty:
-                    st.markdown("###### ⚡ 快速操作")
-                    selected_client_idx = st.selectbox("選擇客戶進行操作:", display_df.index, format_func=lambda x: f"{display_df.loc[x, '姓名']} ({display_df.loc[x, '車牌']})")
-                    
-                    if selected_client_idx is not None:
-                        sel_row = display_df.loc[selected_client_idx]
-                        col_a, col_b, col_c = st.columns([1, 1, 1])
-                        
-                        with col_a:
-                            link = generate_calendar_link(sel_row['姓名'], str(sel_row['到期日']), sel_row['保險種類'])
-                            st.link_button("📅 加入 Google 日曆", link, use_container_width=True)
-                        
-                        with col_b:
-                            if sel_row['電話']:
-                                st.markdown(f'<a href="tel:{sel_row["電話"]}" target="_self"><button style="width:100%; border:1px solid #ddd; background:white; padding:10px; border-radius:5px;">📞 撥打電話</button></a>', unsafe_allow_html=True)
-                            else:
-                                st.button("無電話", disabled=True, use_container_width=True)
-                        
-                        with col_c:
-                            if st.button("🗑️ 刪除此資料", key=f"del_btn_{sel_row['ID']}", use_container_width=True, type="primary"):
-                                delete_client(sel_row['ID'])
-                                st.toast(f"已刪除 {sel_row['姓名']} 的資料", icon="🗑️")
-                                time.sleep(1)
-                                st.rerun()
-
-            else:
-                st.info("目前尚無資料，請至「新增客戶」分頁建立第一筆資料。")
+            render_dashboard(user["username"], today)
 
         # === Tab 2: 新增客戶 (Add Client) ===
         with tab_add:
-            st.markdown("#### 📝 建立新保單")
-            with st.container(border=True):
-                with st.form("add_client_form", clear_on_submit=True):
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        c_name = st.text_input("客戶姓名", placeholder="真實姓名")
-                        c_phone = st.text_input("電話號碼", placeholder="09xx-xxx-xxx")
-                        # [NEW] 保險種類選單
-                        c_type = st.selectbox("保險種類", ["強制險", "任意險", "兩者皆是(日期相同)"])
-                    
-                    with c2:
-                        c_plate = st.text_input("車牌號碼", placeholder="ABC-1234")
-                        c_expiry = st.date_input("保險到期日")
-                        c_notes = st.text_area("備註事項", placeholder="例如：客戶偏好富邦產險...")
-                    
-                    st.caption("🔒 個資保護中：姓名與車牌將加密儲存")
-                    submitted = st.form_submit_button("確認新增", use_container_width=True, type="primary")
-                    
-                    if submitted:
-                        if c_name and c_plate:
-                            success = add_client(user["username"], c_name, c_plate, c_phone, c_expiry, c_type, c_notes)
-                            if success:
-                                st.toast("✅ 資料新增成功！", icon="🎉")
-                                time.sleep(1) # 給一點時間讓 user 看到 toast
-                                st.rerun() # 重新整理以更新 dashboard 數據
-                        else:
-                            st.toast("❌ 姓名與車牌為必填欄位", icon="⚠️")
+            render_add(user, today)
 
         # === Tab 3: 設定 (Settings) ===
         with tab_settings:
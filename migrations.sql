@@ -0,0 +1,42 @@
+-- Supabase (Postgres) 結構調整：於 SQL Editor 依序執行
+
+-- 1. 伺服器端搜尋：姓名/車牌的 HMAC 雜湊欄位與索引 (app.py: search_hash)
+--    既有資料會在業務登入後由 app 自動補上雜湊值 (app.py: backfill_search_hashes)
+alter table clients add column if not exists name_hash text;
+alter table clients add column if not exists plate_hash text;
+create index if not exists clients_agent_name_hash_idx on clients (agent_username, name_hash);
+create index if not exists clients_agent_plate_hash_idx on clients (agent_username, plate_hash);
+
+-- 搜尋 + 分頁 + 總筆數，一次 RPC 完成 (app.py: search_clients)
+create or replace function search_clients(agent text, q text, skip int default 0, take int default 50)
+returns jsonb
+language sql
+stable
+as $$
+  with matched as (
+    select id, encrypted_name, encrypted_plate, phone_number, expiry_date, insurance_type, notes
+    from clients
+    where agent_username = agent
+      and (name_hash = q or plate_hash = q)
+  )
+  select jsonb_build_object(
+    'total', (select count(*) from matched),
+    'rows', coalesce(
+      (select jsonb_agg(p order by p.expiry_date, p.id)
+       from (select * from matched order by expiry_date, id offset skip limit take) p),
+      '[]'::jsonb
+    )
+  );
+$$;
+
+-- 2. 帳號唯一性交由資料庫保證 (login_user 以 username 等值查詢時亦走此索引)
+--    註冊時直接 insert，重複帳號會回傳 unique_violation (23505)
+--    若已有重複帳號，加入約束會失敗；請先以下列查詢找出並手動合併/刪除重複者：
+--      select username, count(*) from users group by username having count(*) > 1;
+do $$
+begin
+  if not exists (select 1 from pg_constraint where conname = 'users_username_key') then
+    alter table users add constraint users_username_key unique (username);
+  end if;
+end
+$$;